@@ -1,9 +1,9 @@
 """Run model inference and save outputs for analysis"""
 import os
+from concurrent.futures import ThreadPoolExecutor
 import hydra
 from omegaconf import DictConfig
 from tqdm import tqdm
-import numpy as np
 
 import torch
 from torch.utils.data import DataLoader
@@ -51,38 +51,62 @@ def get_inference_model(cfg, device=torch.device('cpu')):
     return model
 
 
-def inference(model, dataloader, output_dir, device=torch.device('cpu')):
-    for idx, batch in enumerate(tqdm(dataloader)):
-        for k, x in batch.items():
-            # reshape data for inference
-            # 2d: (N=1, num_slices, H, W) -> (num_slices, N=1, H, W)
-            # 3d: (N=1, 1, H, W, D) -> (1, N=1, H, W, D)
-            batch[k] = x.transpose(0, 1).to(device=device)
-
-        # model inference
-        out = model(batch['target'], batch['source'])
-        batch['disp_pred'] = out[1] if len(out) == 2 else out  # (flow, disp) or disp
-
-        # warp images and segmentation using predicted disp
-        batch['warped_source'] = warp(batch['source'], batch['disp_pred'])
-        if 'source_seg' in batch.keys():
-            batch['warped_source_seg'] = warp(batch['source_seg'], batch['disp_pred'],
-                                              interp_mode='nearest')
-        if 'target_original' in batch.keys():
-            batch['target_pred'] = warp(batch['target_original'], batch['disp_pred'])
-
-        # save the outputs
-        subj_id = dataloader.dataset.subject_list[idx]
-        output_id_dir = setup_dir(output_dir + f'/{subj_id}')
-        for k, x in batch.items():
-            x = x.detach().cpu().numpy()
-            # reshape for saving:
+def inference(model, dataloader, output_dir, device=torch.device('cpu'), save_workers=4):
+    # outputs are saved (gzip compressed) in background threads while the next subject is processed
+    with ThreadPoolExecutor(max_workers=save_workers) as save_pool:
+        save_futures = []
+
+        for idx, batch in enumerate(tqdm(dataloader)):
+            for k, x in batch.items():
+                # reshape data for inference
+                # 2d: (N=1, num_slices, H, W) -> (num_slices, N=1, H, W)
+                # 3d: (N=1, 1, H, W, D) -> (1, N=1, H, W, D)
+                batch[k] = x.transpose(0, 1).to(device=device, non_blocking=True)
+
+            # model inference
+            out = model(batch['target'], batch['source'])
+            batch['disp_pred'] = out[1] if len(out) == 2 else out  # (flow, disp) or disp
+
+            # warp images and segmentation using predicted disp
+            batch['warped_source'] = warp(batch['source'], batch['disp_pred'])
+            if 'source_seg' in batch.keys():
+                batch['warped_source_seg'] = warp(batch['source_seg'], batch['disp_pred'],
+                                                  interp_mode='nearest')
+            if 'target_original' in batch.keys():
+                batch['target_pred'] = warp(batch['target_original'], batch['disp_pred'])
+
+            # copy outputs to host, on GPU all copies are issued asynchronously into pinned memory
+            # and synchronised once
+            if device.type == 'cuda':
+                outputs = dict()
+                for k, x in batch.items():
+                    outputs[k] = torch.empty(x.shape, dtype=x.dtype, pin_memory=True)
+                    outputs[k].copy_(x.detach(), non_blocking=True)
+                torch.cuda.current_stream(device).synchronize()
+            else:
+                outputs = {k: x.detach().cpu() for k, x in batch.items()}
+
+            # wait for the previous subject to be saved (and raise its errors, if any)
+            for f in save_futures:
+                f.result()
+
+            # save the outputs
+            subj_id = dataloader.dataset.subject_list[idx]
+            output_id_dir = setup_dir(output_dir + f'/{subj_id}')
+
+            # reshape for saving with a single transpose:
             # 2D: img (N=num_slice, 1, H, W) -> (H, W, N);
             #     disp (N=num_slice, 2, H, W) -> (H, W, N, 2)
             # 3D: img (N=1, 1, H, W, D) -> (H, W, D);
             #     disp (N=1, 3, H, W, D) -> (H, W, D, 3)
-            x = np.moveaxis(x, [0, 1], [-2, -1]).squeeze()
-            save_nifti(x, path=output_id_dir + f'/{k}.nii.gz')
+            ndim = batch['target'].ndim - 2
+            perm = (*range(2, ndim + 2), 0, 1)
+            save_futures = [save_pool.submit(save_nifti, x.numpy().transpose(perm).squeeze(),
+                                             path=output_id_dir + f'/{k}.nii.gz')
+                            for k, x in outputs.items()]
+
+        for f in save_futures:
+            f.result()
 
 
 @hydra.main(config_path="conf_inference", config_name="config")
@@ -98,7 +122,7 @@ def main(cfg: DictConfig) -> None:
         device = torch.device('cpu')
 
     # configure dataset & model
-    dataloader = get_inference_dataloader(cfg, pin_memory=(device is torch.device('cuda')))
+    dataloader = get_inference_dataloader(cfg, pin_memory=(device.type == 'cuda'))
     model = get_inference_model(cfg, device=device)
 
     # run inference
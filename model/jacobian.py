@@ -0,0 +1,28 @@
+"""Jacobian of displacement fields in Pytorch"""
+from model.loss import finite_diff
+from utils.metric import det_from_jacobian
+
+
+def jacobian_det(disp):
+    """
+    Calculate Jacobian determinant of a batch of displacement fields (2D/3D)
+    on the device of the input Tensor.
+    Follows the same conventions as the Jacobian in `utils.metric`
+    (SimpleITK DisplacementFieldJacobianDeterminant).
+
+    Args:
+        disp: (Tensor float, shape (N, ndim, *sizes)) Displacement field
+
+    Returns:
+        jac_det: (Tensor float, shape (N, *sizes)) Point-wise Jacobian determinant
+    """
+    ndim = disp.size()[1]
+
+    # partial derivatives of all components, column j is differentiated along spatial dim (ndim - 1 - j)
+    derives = [finite_diff(disp, dim=ndim - 1 - j, mode="central") for j in range(ndim)]
+
+    # Jacobian of the transformation (identity + displacement)
+    jac = [[derives[j][:, i, ...] + (i == j) for j in range(ndim)]
+           for i in range(ndim)]
+    return det_from_jacobian(jac)
+
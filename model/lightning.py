@@ -114,7 +114,8 @@ class LightningDLReg(LightningModule):
 
         # log visualisation figure to Tensorboard
         if batch_idx == 0:
-            val_fig = visualise_result(val_data, axis=2)
+            # the figure is logged right away, so it is reused (only its data updated) across validations
+            val_fig = visualise_result(val_data, axis=2, reuse=True)
             self.logger.experiment.add_figure(f'val_fig',
                                               val_fig,
                                               global_step=self.global_step,
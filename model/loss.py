@@ -211,37 +211,41 @@ def finite_diff(x, dim, mode="forward", boundary="Neumann"):
     ndim = x.ndim - 2
     sizes = x.shape[2:]
 
+    # configure padding of this dimension
+    paddings = [[0, 0] for _ in range(ndim)]
+    if mode == "forward":
+        # forward difference: pad after
+        paddings[dim][1] = 1
+    elif mode == "backward":
+        # backward difference: pad before
+        paddings[dim][0] = 1
+    elif mode == "central":
+        # central difference: pad both sides
+        paddings[dim] = [1, 1]
+    else:
+        raise ValueError(f'Mode {mode} not recognised')
+
+    # reverse and join sublists into a flat list (Pytorch uses last -> first dim order)
+    paddings.reverse()
+    paddings = [p for ppair in paddings for p in ppair]
+
+    # pad data
+    if boundary == "Neumann":
+        # Neumann boundary condition
+        x_pad = F.pad(x, paddings, mode='replicate')
+    elif boundary == "Dirichlet":
+        # Dirichlet boundary condition
+        x_pad = F.pad(x, paddings, mode='constant')
+    else:
+        raise ValueError("Boundary condition not recognised.")
+
+    # slice and subtract
     if mode == "central":
-        # TODO: implement central difference by 1d conv or dialated slicing
-        raise NotImplementedError("Finite difference central difference mode")
-    else:  # "forward" or "backward"
-        # configure padding of this dimension
-        paddings = [[0, 0] for _ in range(ndim)]
-        if mode == "forward":
-            # forward difference: pad after
-            paddings[dim][1] = 1
-        elif mode == "backward":
-            # backward difference: pad before
-            paddings[dim][0] = 1
-        else:
-            raise ValueError(f'Mode {mode} not recognised')
-
-        # reverse and join sublists into a flat list (Pytorch uses last -> first dim order)
-        paddings.reverse()
-        paddings = [p for ppair in paddings for p in ppair]
-
-        # pad data
-        if boundary == "Neumann":
-            # Neumann boundary condition
-            x_pad = F.pad(x, paddings, mode='replicate')
-        elif boundary == "Dirichlet":
-            # Dirichlet boundary condition
-            x_pad = F.pad(x, paddings, mode='constant')
-        else:
-            raise ValueError("Boundary condition not recognised.")
-
-        # slice and subtract
+        x_diff = x_pad.index_select(dim + 2, torch.arange(2, sizes[dim] + 2).to(device=x.device)) \
+                 - x_pad.index_select(dim + 2, torch.arange(0, sizes[dim]).to(device=x.device))
+        x_diff = x_diff / 2
+    else:
         x_diff = x_pad.index_select(dim + 2, torch.arange(1, sizes[dim] + 1).to(device=x.device)) \
                  - x_pad.index_select(dim + 2, torch.arange(0, sizes[dim]).to(device=x.device))
 
-        return x_diff
+    return x_diff
@@ -1,54 +1,59 @@
 """ Calculate metric results from the model predictions/outputs"""
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from tqdm import tqdm
 import numpy as np
+import nibabel as nib
 
 from utils.image_io import load_nifti
 from utils.metric import measure_metrics, MetricReporter
 
 
-def analyse_output(inference_output_dir, save_dir, metric_groups):
+# layouts to reshape saved outputs for analysis: {ndim: {data type: (transpose axes, new axes of size 1)}}
+# 2D: img (H, W, N) -> (N=num_slice, 1, H, W)
+#     disp (H, W, N, 2) -> (N=num_slice, 2, H, W)
+# 3D: img (H, W, D) -> (N=1, 1, H, W, D)
+#     disp (H, W, D, 3) -> (N=1, 3, H, W, D)
+LAYOUTS = {2: {'disp': ((2, 3, 0, 1), ()),
+               'img': ((2, 0, 1), (1,))},
+           3: {'disp': ((3, 0, 1, 2), (0,)),
+               'img': ((0, 1, 2), (0, 1))}}
+
+
+def analyse_output(inference_output_dir, save_dir, metric_groups, workers=1):
     print("Running output analysis:")
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
 
-    metric_reporter = MetricReporter(id_list=os.listdir(inference_output_dir),
+    subj_list = os.listdir(inference_output_dir)
+    metric_reporter = MetricReporter(id_list=subj_list,
                                      save_dir=save_dir)
 
-    for d in tqdm(os.listdir(inference_output_dir)):
-        subj_output_dir = inference_output_dir + f'/{d}'
-
-        # load saved output data from inference
-        file_names = os.listdir(subj_output_dir)
-        data_dict = dict()
-        for fn in file_names:
-            # file names as dict keys
-            k = fn.split('.')[0]
-            data_dict[k] = load_nifti(subj_output_dir + f'/{fn}')
-
-        ndim = data_dict['disp_pred'].shape[-1]
-        for k, x in data_dict.items():
-            # reshape from saved for analysis:
-            if ndim == 2:
-                # 2D: img (H, W, N) -> (N=num_slice, 1, H, W)
-                #     disp (H, W, N, 2) -> (N=num_slice, 2, H, W)
-                if k == 'disp_gt' or k == 'disp_pred':
-                    data_dict[k] = x.transpose(2, 3, 0, 1)
-                else:
-                    data_dict[k] = x.transpose(2, 0, 1)[:, np.newaxis, ...]
-
-            if ndim == 3:
-                # 3D: img (H, W, D) -> (N=1, 1, H, W, D)
-                #     disp (H, W, D, 3) -> (N=1, 3, H, W, D)
-                if k == 'disp_gt' or k == 'disp_pred':
-                    data_dict[k] = x.transpose(3, 0, 1, 2)[np.newaxis, ...]
-                else:
-                    data_dict[k] = x[np.newaxis, np.newaxis, ...]
-
-        # calculate metric for one validation batch
-        metric_result_step = measure_metrics(data_dict, metric_groups)
-        metric_reporter.collect(metric_result_step)
+    subj_output_dirs = [inference_output_dir + f'/{d}' for d in subj_list]
+
+    # all subjects have the same output files and data dimension,
+    # map file names to data keys and choose the layout of each data key once from the first subject
+    # (only the header of the first disp is read to find the dimension)
+    key_by_fn, layout_by_key = None, None
+    if len(subj_output_dirs) > 0:
+        key_by_fn = get_key_by_fn(subj_output_dirs[0])
+        ndim = nib.load(subj_output_dirs[0] + '/disp_pred.nii.gz').shape[-1]
+        layout_by_key = get_layout_by_key(key_by_fn.values(), ndim)
+
+    if workers > 1:
+        # subjects are analysed in parallel processes, results are collected in order
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            metric_results = executor.map(analyse_subject, subj_output_dirs,
+                                          repeat(metric_groups), repeat(key_by_fn), repeat(layout_by_key),
+                                          chunksize=4)
+            for idx, metric_result_step in enumerate(tqdm(metric_results, total=len(subj_output_dirs))):
+                metric_reporter.collect(metric_result_step, idx)
+    else:
+        for idx, subj_output_dir in enumerate(tqdm(subj_output_dirs)):
+            metric_reporter.collect(analyse_subject(subj_output_dir, metric_groups,
+                                                    key_by_fn, layout_by_key), idx)
 
     # save the metric results
     metric_reporter.summarise()
@@ -56,6 +61,59 @@ def analyse_output(inference_output_dir, save_dir, metric_groups):
     metric_reporter.save_df()
 
 
+def get_key_by_fn(subj_output_dir):
+    """ Map the output file names of a subject to data keys {file name: data key} """
+    return {fn: fn.split('.')[0] for fn in os.listdir(subj_output_dir)}
+
+
+def get_layout_by_key(keys, ndim):
+    """ Layouts to reshape the saved outputs for analysis {data key: (transpose axes, new axes of size 1)} """
+    return {k: LAYOUTS[ndim]['disp' if k in ('disp_gt', 'disp_pred') else 'img'] for k in keys}
+
+
+def apply_layout(x, axes, new_axes):
+    """ Transpose into C-contiguous array and insert new axes of size 1 (without copying again) """
+    x = np.ascontiguousarray(x.transpose(axes))
+    shape = list(x.shape)
+    for a in new_axes:
+        shape.insert(a, 1)
+    return x.reshape(shape)
+
+
+def analyse_subject(subj_output_dir, metric_groups, key_by_fn=None, layout_by_key=None):
+    """
+    Load the saved inference outputs of one subject and calculate metrics
+
+    Args:
+        subj_output_dir: (string) inference output directory of the subject
+        metric_groups: (list of strings) name of metric groups
+        key_by_fn: (dict) {file name: data key}, listed from subj_output_dir if not given
+        layout_by_key: (dict) {data key: layout}, chosen by the dimension of the loaded disp if not given
+
+    Returns:
+        metric_results: (dict) {metric_name: metric_value}
+    """
+    if key_by_fn is None:
+        key_by_fn = get_key_by_fn(subj_output_dir)
+
+    # load saved output data from inference
+    # (files are read and decompressed in parallel threads)
+    with ThreadPoolExecutor(max_workers=min(len(key_by_fn), 8)) as executor:
+        # file names as dict keys
+        futures = {k: executor.submit(load_nifti, subj_output_dir + f'/{fn}')
+                   for fn, k in key_by_fn.items()}
+    data_dict = {k: f.result() for k, f in futures.items()}
+
+    if layout_by_key is None:
+        layout_by_key = get_layout_by_key(data_dict.keys(), data_dict['disp_pred'].shape[-1])
+
+    # reshape from saved for analysis
+    data_dict = {k: apply_layout(x, *layout_by_key[k]) for k, x in data_dict.items()}
+
+    # calculate metric for one subject
+    return measure_metrics(data_dict, metric_groups)
+
+
 if __name__ == '__main__':
     # main single run to analyse outputs of one model
     import sys
@@ -69,6 +127,10 @@ if __name__ == '__main__':
                         nargs='*',
                         type=str,
                         default=["disp_metrics", "image_metrics", "seg_metrics"])
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        help='number of processes analysing subjects in parallel')
     args = parser.parse_args()
 
     # default inference output directory
@@ -7,7 +7,8 @@ from PIL import Image
 
 def load_nifti(path, data_type=np.float32, nim=False):
     xnim = nib.load(path)
-    x = np.asanyarray(xnim.dataobj).astype(data_type)
+    # no extra copy if the data is already stored in the requested data type
+    x = np.asanyarray(xnim.dataobj).astype(data_type, copy=False)
     if nim:
         return x, xnim
     else:
@@ -41,6 +42,14 @@ def upsample_image(image, size):
     return np.array(Image.fromarray(image).resize((size, size)))
 
 
+def frames_first_uint8(images):
+    """
+    Cast frames-last images to uint8 in a C-contiguous frames-first array,
+    so that each frame is a contiguous block: (H, W, [ch,] Frames) -> (Frames, H, W, [ch])
+    """
+    return np.moveaxis(images, -1, 0).astype(np.uint8, order='C')
+
+
 def save_gif(images, path, fps=20):
     """
     Save numpy array to gif
@@ -51,9 +60,12 @@ def save_gif(images, path, fps=20):
         path: save destination file path
         fps: frame rate of the gif
     """
-    images = images.astype(np.uint8)
-    frame_list = [upsample_image(images[..., fr], 300) for fr in range(images.shape[-1])]
-    imageio.mimwrite(path, frame_list, fps=fps)
+    frames = frames_first_uint8(images)
+    # write frames incrementally instead of accumulating all upsampled frames,
+    # only the changed sub-rectangle of each frame is stored
+    with imageio.get_writer(path, mode='I', fps=fps, subrectangles=True) as writer:
+        for frame in frames:
+            writer.append_data(upsample_image(frame, 300))
 
 
 def save_png(images, path_dir):
@@ -65,10 +77,12 @@ def save_png(images, path_dir):
                 or (H, W, ch, Frames) for colored images
         path_dir: save destination directory path
     """
-    images = images.astype(np.uint8)
-    for fr in range(images.shape[-1]):
-        image = upsample_image(images[..., fr], 300)
-        imageio.imwrite(os.path.join(path_dir, 'frame_{}.png'.format(fr)), image)
+    frames = frames_first_uint8(images)
+    os.makedirs(path_dir, exist_ok=True)
+    path_prefix = os.path.join(path_dir, 'frame_')
+    for fr, frame in enumerate(frames):
+        image = upsample_image(frame, 300)
+        imageio.imwrite(f'{path_prefix}{fr}.png', image)
 
 
 def split_volume(image_name, output_name):
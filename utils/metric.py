@@ -2,8 +2,6 @@ import numpy as np
 import pandas as pd
 import torch
 import cv2
-from scipy.spatial.distance import directed_hausdorff
-import SimpleITK as sitk
 from utils.image import bbox_from_mask, bbox_crop
 
 from utils.misc import save_dict_to_csv
@@ -12,6 +10,9 @@ from utils.misc import save_dict_to_csv
 def measure_metrics(metric_data, metric_groups, return_tensor=False):
     """
     Wrapper function for calculating all metrics
+    If roi_mask is given, disp and image metrics are only evaluated in the bounding box of the mask
+    (disp is also masked by the roi mask).
+
     Args:
         metric_data: (dict) data used for calculation of metrics, could be Tensor or Numpy Array
         metric_groups: (list of strings) name of metric groups
@@ -21,17 +22,16 @@ def measure_metrics(metric_data, metric_groups, return_tensor=False):
         metrics_results: (dict) {metric_name: metric_value}
     """
 
-    # cast Tensor to Numpy Array if needed
-    for k, x in metric_data.items():
-        if isinstance(x, torch.Tensor):
-            metric_data[k] = x.cpu().numpy()
-
     # keys must match metric_groups and params.metric_groups
     # (using groups to share pre-scripts)
     metric_group_fns = {'disp_metrics': measure_disp_metrics,
                         'image_metrics': measure_image_metrics,
                         'seg_metrics': measure_seg_metrics}
 
+    # mask and crop data by the roi mask bounding box once for all metric groups
+    if 'roi_mask' in metric_data.keys():
+        metric_data = _roi_mask_and_crop(metric_data, metric_groups)
+
     metric_results = dict()
     for group in metric_groups:
         metric_results.update(metric_group_fns[group](metric_data))
@@ -44,6 +44,50 @@ def measure_metrics(metric_data, metric_groups, return_tensor=False):
     return metric_results
 
 
+def _roi_mask_and_crop(metric_data, metric_groups):
+    """
+    Mask the disp by the roi mask and crop disp and images by the bounding box of the roi mask,
+    so that disp and image metrics are only evaluated in the bounding box.
+    (Segmentation metrics are evaluated on the full images)
+
+    Args:
+        metric_data: (dict) must contain 'roi_mask' of shape (N, 1, *(sizes))
+        metric_groups: (list of strings) name of metric groups
+
+    Returns:
+        roi_metric_data: (dict) new dict of metric data, data in metric_data is not changed
+    """
+    roi_mask = metric_data['roi_mask']
+    mask_bbox, mask_bbox_mask = bbox_from_mask(_to_numpy(roi_mask)[:, 0, ...])
+
+    roi_metric_data = dict(metric_data)
+    if 'disp_metrics' in metric_groups:
+        # crop before masking to only multiply within the bounding box
+        roi_mask_crop = bbox_crop(roi_mask, mask_bbox)
+        for k in ['disp_pred', 'disp_gt']:
+            if k in metric_data.keys():
+                roi_metric_data[k] = bbox_crop(metric_data[k], mask_bbox) * roi_mask_crop
+
+    if 'image_metrics' in metric_groups:
+        for k in ['target', 'target_pred']:
+            roi_metric_data[k] = bbox_crop(metric_data[k], mask_bbox)
+    return roi_metric_data
+
+
+def _to_numpy(x):
+    """ Cast Tensor to Numpy Array if needed """
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    return x
+
+
+def _contiguous_float32(x):
+    """ Cast Numpy Array to C-contiguous float32 (Tensor is returned as it is) """
+    if isinstance(x, np.ndarray):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+    return x
+
+
 """
 Functions calculating groups of metrics
 """
@@ -52,7 +96,8 @@ Functions calculating groups of metrics
 def measure_disp_metrics(metric_data):
     """
     Calculate DVF-related metrics.
-    If roi_mask is given, the disp is masked and only evaluate in the bounding box of the mask.
+    If disp is a Tensor, the Jacobian metrics are calculated on its device
+    and only the disp accuracy metrics require casting the disp to Numpy Array.
 
     Args:
         metric_data: (dict)
@@ -60,25 +105,10 @@ def measure_disp_metrics(metric_data):
     Returns:
         metric_results: (dict)
     """
-    # new object to avoid changing data in metric_data
-    disp_pred = metric_data['disp_pred']
+    # contiguous float32 arrays for the memory-bound metric calculation
+    disp_pred = _contiguous_float32(metric_data['disp_pred'])
     if 'disp_gt' in metric_data.keys():
-        disp_gt = metric_data['disp_gt']
-
-    # mask the disp with roi mask if given
-    if 'roi_mask' in metric_data.keys():
-        roi_mask = metric_data['roi_mask']  # (N, 1, *(sizes))
-
-        # find roi mask bbox mask
-        mask_bbox, mask_bbox_mask = bbox_from_mask(roi_mask[:, 0, ...])
-
-        # mask and bbox crop dvf gt and pred by roi_mask
-        disp_pred = disp_pred * roi_mask
-        disp_pred = bbox_crop(disp_pred, mask_bbox)
-
-        if 'disp_gt' in metric_data.keys():
-            disp_gt = disp_gt * roi_mask
-            disp_gt = bbox_crop(disp_gt, mask_bbox)
+        disp_gt = _contiguous_float32(metric_data['disp_gt'])
 
     # Regularity (Jacobian) metrics
     folding_ratio, mag_det_jac_det = calculate_jacobian_metrics(disp_pred)
@@ -89,30 +119,25 @@ def measure_disp_metrics(metric_data):
 
     # DVF accuracy metrics if ground truth is available
     if 'disp_gt' in metric_data.keys():
-        disp_metric_results.update({'aee': calculate_aee(disp_pred, disp_gt),
-                                   'rmse_disp': calculate_rmse_disp(disp_pred, disp_gt)})
+        disp_pred = _contiguous_float32(_to_numpy(disp_pred))
+        disp_gt = _contiguous_float32(_to_numpy(disp_gt))
+        aee, rmse_disp = calculate_aee_and_rmse_disp(disp_pred, disp_gt)
+        disp_metric_results.update({'aee': aee,
+                                   'rmse_disp': rmse_disp})
     return disp_metric_results
 
 
 def measure_image_metrics(metric_data):
     # unpack metric data, keys must match metric_data input
-    img = metric_data['target']
-    img_pred = metric_data['target_pred']  # (N, 1, *sizes)
-
-    # crop out image by the roi mask bounding box if given
-    if 'roi_mask' in metric_data.keys():
-        roi_mask = metric_data['roi_mask']
-        mask_bbox, mask_bbox_mask = bbox_from_mask(roi_mask[:, 0, ...])
-        img = bbox_crop(img, mask_bbox)
-        img_pred = bbox_crop(img_pred, mask_bbox)
-
+    img = _contiguous_float32(_to_numpy(metric_data['target']))
+    img_pred = _contiguous_float32(_to_numpy(metric_data['target_pred']))  # (N, 1, *sizes)
     return {'rmse': calculate_rmse(img, img_pred)}
 
 
 def measure_seg_metrics(metric_data):
     """ Calculate segmentation """
-    seg_gt = metric_data['target_seg']
-    seg_pred = metric_data['warped_source_seg']
+    seg_gt = _to_numpy(metric_data['target_seg'])
+    seg_pred = _to_numpy(metric_data['warped_source_seg'])
     assert seg_gt.ndim == seg_pred.ndim
 
     results = dict()
@@ -133,27 +158,43 @@ Functions calculating individual metrics
 """
 
 
-def calculate_aee(x, y):
+def calculate_aee_and_rmse_disp(x, y):
     """
-    Average End point Error (AEE, mean over point-wise L2 norm)
+    AEE and RMSE of DVF computed from a single pass over the squared error
     Input DVF shape: (N, dim, *(sizes))
     """
-    return np.sqrt(((x - y) ** 2).sum(axis=1)).mean()
-
-
-def calculate_rmse_disp(x, y):
-    """
-    RMSE of DVF (square root over mean of sum squared)
-    Input DVF shape: (N, dim, *(sizes))
-    """
-    return np.sqrt(((x - y) ** 2).sum(axis=1).mean())
+    sq_err = _squared_error(x, y)
+    sum_sq_err = sq_err.sum(axis=1)
+    return np.sqrt(sum_sq_err).mean(), np.sqrt(sum_sq_err.mean())
 
 
 def calculate_rmse(x, y):
     """Standard RMSE formula, square root over mean
     (https://wikimedia.org/api/rest_v1/media/math/render/svg/6d689379d70cd119e3a9ed3c8ae306cafa5d516d)
     """
-    return np.sqrt(((x - y) ** 2).mean())
+    return np.sqrt(_squared_error(x, y).mean())
+
+
+# working buffers of squared errors reused across metric calculations {dtype: flat buffer}
+_sq_err_buffers = dict()
+
+
+def _squared_error(x, y):
+    """
+    Point-wise squared error of two Numpy Arrays written into a working buffer,
+    which is re-used (and grown if needed) across calls to avoid re-allocating full-size temporaries.
+    The result is only valid until the next call.
+    """
+    shape = np.broadcast(x, y).shape
+    dtype = np.result_type(x, y)
+    size = int(np.prod(shape))
+    if dtype not in _sq_err_buffers or _sq_err_buffers[dtype].size < size:
+        _sq_err_buffers[dtype] = np.empty(size, dtype=dtype)
+    sq_err = _sq_err_buffers[dtype][:size].reshape(shape)
+
+    np.subtract(x, y, out=sq_err)
+    np.square(sq_err, out=sq_err)
+    return sq_err
 
 
 def calculate_jacobian_metrics(disp):
@@ -161,38 +202,110 @@ def calculate_jacobian_metrics(disp):
     Calculate Jacobian related regularity metrics.
 
     Args:
-        disp: (numpy.ndarray, shape (N, ndim, *sizes) Displacement field
+        disp: (numpy.ndarray or Tensor, shape (N, ndim, *sizes) Displacement field,
+              Tensor is processed on its own device
 
     Returns:
         folding_ratio: (scalar) Folding ratio (ratio of Jacobian determinant < 0 points)
         mag_grad_jac_det: (scalar) Mean magnitude of the spatial gradient of Jacobian determinant
     """
-    folding_ratio = []
-    mag_grad_jac_det = []
-    for n in range(disp.shape[0]):
-        disp_n = np.moveaxis(disp[n, ...], 0, -1)  # (*sizes, ndim)
-        jac_det_n = calculate_jacobian_det(disp_n)
-        folding_ratio += [(jac_det_n < 0).sum() / np.prod(jac_det_n.shape)]
-        mag_grad_jac_det += [np.abs(np.gradient(jac_det_n)).mean()]
-    return np.mean(folding_ratio), np.mean(mag_grad_jac_det)
+    ndim = disp.shape[1]
+
+    if isinstance(disp, torch.Tensor):
+        with torch.no_grad():
+            jac_det = _jacobian_det_batch(disp)  # (N, *sizes)
+            folding_ratio = (jac_det < 0).float().mean().item()
+
+            sum_abs_grad = 0.
+            for i in range(ndim):
+                sum_abs_grad += _sum_abs_gradient_tensor(jac_det, dim=i + 1)
+            mag_grad_jac_det = sum_abs_grad.item() / (ndim * jac_det.numel())
+        return folding_ratio, mag_grad_jac_det
+
+    jac_det = _jacobian_det_batch(disp)  # (N, *sizes)
+    folding_ratio = (jac_det < 0).mean()
+
+    # accumulate the gradient magnitude axis by axis rather than stacking all gradients
+    sum_abs_grad = 0.
+    for i in range(ndim):
+        sum_abs_grad += np.abs(np.gradient(jac_det, axis=i + 1)).sum()
+    mag_grad_jac_det = sum_abs_grad / (ndim * jac_det.size)
+    return folding_ratio, mag_grad_jac_det
+
+
+def _sum_abs_gradient_tensor(x, dim):
+    """ Sum of absolute gradient of a Tensor along a dimension (same finite differences as numpy.gradient) """
+    size = x.shape[dim]
+    edges = (x.narrow(dim, 1, 1) - x.narrow(dim, 0, 1)).abs().sum() \
+            + (x.narrow(dim, size - 1, 1) - x.narrow(dim, size - 2, 1)).abs().sum()
+    inner = (x.narrow(dim, 2, size - 2) - x.narrow(dim, 0, size - 2)).abs().sum() / 2
+    return edges + inner
 
 
-def calculate_jacobian_det(disp):
+def _jacobian_det_batch(disp):
     """
-    Calculate Jacobian determinant of displacement field of one image/volume (2D/3D)
+    Calculate Jacobian determinant of a batch of displacement fields (2D/3D).
+    Follows the conventions of SimpleITK DisplacementFieldJacobianDeterminant, i.e.
+    vector component i is differentiated along the spatial axis (ndim - 1 - j) for column j,
+    using central differences with replicated boundary.
 
     Args:
-        disp: (numpy.ndarray, shape (*sizes, ndim)) Displacement field
+        disp: (numpy.ndarray or Tensor, shape (N, ndim, *sizes)) Displacement field
 
     Returns:
-        jac_det: (numpy.adarray, shape (*sizes) Point-wise Jacobian determinant
+        jac_det: (numpy.ndarray or Tensor, shape (N, *sizes)) Point-wise Jacobian determinant
     """
-    disp_img = sitk.GetImageFromArray(disp, isVector=True)
-    jac_det_img = sitk.DisplacementFieldJacobianDeterminant(disp_img)
-    jac_det = sitk.GetArrayFromImage(jac_det_img)
+    ndim = disp.shape[1]
+
+    # Jacobian of the transformation (identity + displacement)
+    jac = [[_central_diff(disp[:, i, ...], axis=ndim - j) + (i == j)
+            for j in range(ndim)]
+           for i in range(ndim)]
+
+    return det_from_jacobian(jac)
+
+
+def det_from_jacobian(jac):
+    """
+    Closed-form determinant of a 2x2 or 3x3 Jacobian given as nested lists `jac[i][j]`
+    of point-wise Tensors or Numpy arrays (only uses element-wise `*` and `-`)
+
+    Args:
+        jac: (list of lists) Jacobian entries, each of shape (N, *sizes)
+
+    Returns:
+        jac_det: (Tensor or numpy.ndarray, shape (N, *sizes)) Point-wise Jacobian determinant
+    """
+    ndim = len(jac)
+    if ndim == 2:
+        jac_det = jac[0][0] * jac[1][1] - jac[0][1] * jac[1][0]
+
+    elif ndim == 3:
+        jac_det = jac[0][0] * (jac[1][1] * jac[2][2] - jac[1][2] * jac[2][1]) \
+                  - jac[0][1] * (jac[1][0] * jac[2][2] - jac[1][2] * jac[2][0]) \
+                  + jac[0][2] * (jac[1][0] * jac[2][1] - jac[1][1] * jac[2][0])
+
+    else:
+        raise ValueError(f"Jacobian determinant not supported for dimension {ndim}")
     return jac_det
 
 
+def _central_diff(x, axis):
+    """ Central finite difference along an axis, with replicated (zero-flux) boundary """
+    if isinstance(x, torch.Tensor):
+        # pad by replicating the boundary slices
+        size = x.shape[axis]
+        x = torch.cat([x.narrow(axis, 0, 1), x, x.narrow(axis, size - 1, 1)], dim=axis)
+        return (x.narrow(axis, 2, size) - x.narrow(axis, 0, size)) / 2
+
+    x = np.moveaxis(x, axis, 0)
+    dx = np.empty_like(x)
+    dx[1:-1] = (x[2:] - x[:-2]) / 2
+    dx[0] = (x[1] - x[0]) / 2
+    dx[-1] = (x[-1] - x[-2]) / 2
+    return np.moveaxis(dx, 0, axis)
+
+
 def calculate_dice(mask1, mask2, label_class=0):
     """
     Dice score of a specified class between two label masks.
@@ -206,14 +319,15 @@ def calculate_dice(mask1, mask2, label_class=0):
     Returns:
         volume_dice
     """
-    mask1_pos = (mask1 == label_class).astype(np.float32)
-    mask2_pos = (mask2 == label_class).astype(np.float32)
+    # boolean masks and counting instead of float masks and summation
+    mask1_pos = mask1 == label_class
+    mask2_pos = mask2 == label_class
 
     assert mask1.ndim == mask2.ndim
     axes = tuple(range(2, mask1.ndim))
-    pos1and2 = np.sum(mask1_pos * mask2_pos, axis=axes)
-    pos1 = np.sum(mask1_pos, axis=axes)
-    pos2 = np.sum(mask2_pos, axis=axes)
+    pos1and2 = np.count_nonzero(mask1_pos & mask2_pos, axis=axes)
+    pos1 = np.count_nonzero(mask1_pos, axis=axes)
+    pos2 = np.count_nonzero(mask2_pos, axis=axes)
     return np.mean(2 * pos1and2 / (pos1 + pos2 + 1e-7))
 
 
@@ -231,40 +345,61 @@ def contour_distances_2d(image1, image2, dx=1):
         mean_hausdorff_dist: Hausdorff distance (mean if input are 2D stacks) in pixels
     """
 
-    # Retrieve contours as list of the coordinates of the points for each contour
     # convert to contiguous array and data type uint8 as required by the cv2 function
     image1 = np.ascontiguousarray(image1, dtype=np.uint8)
     image2 = np.ascontiguousarray(image2, dtype=np.uint8)
 
-    # extract contour points and stack the contour points into (N, 2)
-    contours1, _ = cv2.findContours(image1.astype('uint8'), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-    contour1_pts = np.array(contours1[0])[:, 0, :]
-    for i in range(1, len(contours1)):
-        cont1_arr = np.array(contours1[i])[:, 0, :]
-        contour1_pts = np.vstack([contour1_pts, cont1_arr])
-
-    contours2, _ = cv2.findContours(image2.astype('uint8'), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
-    contour2_pts = np.array(contours2[0])[:, 0, :]
-    for i in range(1, len(contours2)):
-        cont2_arr = np.array(contours2[i])[:, 0, :]
-        contour2_pts = np.vstack([contour2_pts, cont2_arr])
-
-    # distance matrix between two point sets
-    dist_matrix = np.zeros((contour1_pts.shape[0], contour2_pts.shape[0]))
-    for i in range(contour1_pts.shape[0]):
-        for j in range(contour2_pts.shape[0]):
-            dist_matrix[i, j] = np.linalg.norm(contour1_pts[i, :] - contour2_pts[j, :])
+    # contour points (x, y) of each mask, in the order (and multiplicity) traced by OpenCV
+    contour1_pts = _contour_points(image1)
+    contour2_pts = _contour_points(image2)
+
+    # contour distances are undefined if either mask has no contour
+    if len(contour1_pts) == 0 or len(contour2_pts) == 0:
+        return np.nan, np.nan
+
+    # distance from every pixel to the nearest contour point of the other mask,
+    # which replaces the (N, M) pair-wise distance matrix between the two point sets
+    # (exact Euclidean distance transform in OpenCV, to the nearest zero pixel),
+    # evaluated at the contour points so that points traced more than once (thin structures) are weighted as before
+    dist_to_contour1 = cv2.distanceTransform(_not_at_points(image1.shape, contour1_pts),
+                                             cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    dist_to_contour2 = cv2.distanceTransform(_not_at_points(image2.shape, contour2_pts),
+                                             cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
+    dist_2_to_1 = dist_to_contour1[contour2_pts[:, 1], contour2_pts[:, 0]]
+    dist_1_to_2 = dist_to_contour2[contour1_pts[:, 1], contour1_pts[:, 0]]
 
     # symmetrical mean contour distance
-    mean_contour_dist = 0.5 * (np.mean(np.min(dist_matrix, axis=0)) + np.mean(np.min(dist_matrix, axis=1)))
+    mean_contour_dist = 0.5 * (np.mean(dist_2_to_1) + np.mean(dist_1_to_2))
 
-    # calculate Hausdorff distance using the accelerated method
-    # (doesn't really save computation since pair-wise distance matrix has to be computed for MCD anyways)
-    hausdorff_dist = directed_hausdorff(contour1_pts, contour2_pts)[0]
+    # symmetrical Hausdorff distance
+    hausdorff_dist = max(np.max(dist_2_to_1), np.max(dist_1_to_2))
 
     return mean_contour_dist * dx, hausdorff_dist * dx
 
 
+def _contour_points(image):
+    """
+    Extract the points of the external contours of a 2D binary mask
+
+    Args:
+        image: (numpy.ndarray, uint8, shape (H, W)) binary mask
+
+    Returns:
+        contour_pts: (numpy.ndarray, shape (N, 2)) (x, y) coordinates of the contour points
+    """
+    contours, _ = cv2.findContours(image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    if len(contours) == 0:
+        return np.zeros((0, 2), dtype=int)
+    return np.concatenate(contours)[:, 0, :]
+
+
+def _not_at_points(shape, pts):
+    """ uint8 image of `shape` which is 0 at the (x, y) points and 1 elsewhere """
+    image = np.ones(shape, dtype=np.uint8)
+    image[pts[:, 1], pts[:, 0]] = 0
+    return image
+
+
 def contour_distances_stack(stack1, stack2, label_class, dx=1):
     """
     Measure mean contour distance metrics between two 2D stacks
@@ -287,17 +422,18 @@ def contour_distances_stack(stack1, stack2, label_class, dx=1):
     stack1 = (stack1 == label_class).astype('uint8')
     stack2 = (stack2 == label_class).astype('uint8')
 
+    # ignore empty masks: find slices non-empty in both stacks at once
+    nonempty = np.any(stack1, axis=(0, 1)) & np.any(stack2, axis=(0, 1))
+
     mcd_buffer = []
     hd_buffer = []
-    for slice_idx in range(stack1.shape[-1]):
-        # ignore empty masks
-        if np.sum(stack1[:, :, slice_idx]) > 0 and np.sum(stack2[:, :, slice_idx]) > 0:
-            slice1 = stack1[:, :, slice_idx]
-            slice2 = stack2[:, :, slice_idx]
-            mcd, hd = contour_distances_2d(slice1, slice2, dx=dx)
+    for slice_idx in np.nonzero(nonempty)[0]:
+        slice1 = stack1[:, :, slice_idx]
+        slice2 = stack2[:, :, slice_idx]
+        mcd, hd = contour_distances_2d(slice1, slice2, dx=dx)
 
-            mcd_buffer += [mcd]
-            hd_buffer += [hd]
+        mcd_buffer += [mcd]
+        hd_buffer += [hd]
 
     return np.mean(mcd_buffer), np.mean(hd_buffer)
 
@@ -305,13 +441,15 @@ def contour_distances_stack(stack1, stack2, label_class, dx=1):
 class MetricReporter(object):
     """
     Collect and report values
-        self.collect_value() collects value in `report_data_dict`, which is structured as:
-            self.report_data_dict = {'value_name_A': [A1, A2, ...], ... }
+        self.collect() collects value in `report_data_dict`, which is structured as:
+            self.report_data_dict = {'value_name_A': array([A1, A2, ...]), ... }
+        (one pre-allocated array of length len(id_list) per value name, NaN if not collected,
+         the ids collected for each value name are marked in `self.collected`)
 
         self.summarise() construct the report dictionary if called, which is structured as:
             self.report = {'value_name_A': {'mean': A_mean,
                                             'std': A_std,
-                                            'list': [A1, A2, ...]}
+                                            'list': array([A1, A2, ...])}
                             }
     """
     def __init__(self, id_list, save_dir, save_name='analysis_results'):
@@ -320,24 +458,36 @@ class MetricReporter(object):
         self.save_name = save_name
 
         self.report_data_dict = {}
+        self.collected = {}
         self.report = {}
+        self.next_idx = 0
 
     def reset(self):
         self.report_data_dict = {}
+        self.collected = {}
         self.report = {}
+        self.next_idx = 0
 
-    def collect(self, x):
+    def collect(self, x, idx=None):
+        """ Collect values of the id at index `idx` of id_list (the next index if not given) """
+        if idx is None:
+            idx = self.next_idx
         for name, value in x.items():
             if name not in self.report_data_dict.keys():
-                self.report_data_dict[name] = []
-            self.report_data_dict[name].append(value)
+                self.report_data_dict[name] = np.full(len(self.id_list), np.nan)
+                self.collected[name] = np.zeros(len(self.id_list), dtype=bool)
+            self.report_data_dict[name][idx] = value
+            self.collected[name][idx] = True
+        self.next_idx = idx + 1
 
     def summarise(self):
         # summarise aggregated results to form the report dict
+        # (values not collected for some ids are ignored, NaN values collected are propagated)
         for name in self.report_data_dict:
+            collected_values = self.report_data_dict[name][self.collected[name]]
             self.report[name] = {
-                'mean': np.mean(self.report_data_dict[name]),
-                'std': np.std(self.report_data_dict[name]),
+                'mean': np.mean(collected_values),
+                'std': np.std(collected_values),
                 'list': self.report_data_dict[name]
             }
 
@@ -3,28 +3,43 @@ import torch
 import os
 import random
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# result figure layout, the same for every call of plot_result_fig()
+RESULT_FIG_SIZE = (30, 18)
+RESULT_FIG_TITLE_PAD = 10
+RESULT_FIG_ADJUST = {"left": 0.0001, "right": 0.99, "top": 0.9, "bottom": 0.1, "wspace": 0.001, "hspace": 0.1}
+
+
+def warped_grid_lines(disp, sizes, interval=3):
+    """Line segments of the regular grid (on image of `sizes`) warped by disp shape (2, H, W)"""
+    id_grid_H, id_grid_W = np.meshgrid(range(0, sizes[0] - 1, interval),
+                                       range(0, sizes[1] - 1, interval),
+                                       indexing='ij')
+
+    # sample disp on the grid by strided slicing (a view) rather than fancy indexing (a gather copy)
+    grid_slicer = (slice(0, sizes[0] - 1, interval), slice(0, sizes[1] - 1, interval))
+    new_grid_H = id_grid_H + disp[0][grid_slicer]
+    new_grid_W = id_grid_W + disp[1][grid_slicer]
+
+    # line segments use CV x-y indexing
+    grid_pts = np.stack([new_grid_W, new_grid_H], axis=-1)  # (nH, nW, 2)
+    return [*grid_pts, *grid_pts.transpose(1, 0, 2)]  # horizontal lines, vertical lines
 
 
 def plot_warped_grid(ax, disp, bg_img=None, interval=3, title="$\mathcal{T}_\phi$", fontsize=30, color='c'):
-    """disp shape (2, H, W)"""
+    """disp shape (2, H, W), returns the LineCollection of the warped grid"""
     if bg_img is not None:
         background = bg_img
     else:
         background = np.zeros(disp.shape[1:])
 
-    id_grid_H, id_grid_W = np.meshgrid(range(0, background.shape[0] - 1, interval),
-                                       range(0, background.shape[1] - 1, interval),
-                                       indexing='ij')
-
-    new_grid_H = id_grid_H + disp[0, id_grid_H, id_grid_W]
-    new_grid_W = id_grid_W + disp[1, id_grid_H, id_grid_W]
-
-    kwargs = {"linewidth": 1.5, "color": color}
-    # matplotlib.plot() uses CV x-y indexing
-    for i in range(new_grid_H.shape[0]):
-        ax.plot(new_grid_W[i, :], new_grid_H[i, :], **kwargs)  # each draws a horizontal line
-    for i in range(new_grid_H.shape[1]):
-        ax.plot(new_grid_W[:, i], new_grid_H[:, i], **kwargs)  # each draws a vertical line
+    # draw all grid lines as a single collection
+    lines = warped_grid_lines(disp, background.shape, interval=interval)
+    grid = ax.add_collection(LineCollection(lines, linewidths=1.5, colors=color))
 
     ax.set_title(title, fontsize=fontsize)
     ax.imshow(background, cmap='gray')
@@ -33,69 +48,120 @@ def plot_warped_grid(ax, disp, bg_img=None, interval=3, title="$\mathcal{T}_\phi
     ax.set_xticks([])
     ax.set_yticks([])
     ax.set_frame_on(False)
+    return grid
 
 
-def plot_result_fig(vis_data_dict, save_path=None, title_font_size=20, dpi=100, show=False, close=False):
-    """Plot visual results in a single figure/subplots.
-    Images should be shaped (*sizes)
-    Disp should be shaped (ndim, *sizes)
-
-    vis_data_dict.keys() = ['target', 'source', 'target_original',
-                            'target_pred', 'warped_source',
-                            'disp_gt', 'disp_pred']
-    """
-    fig = plt.figure(figsize=(30, 18))
-    title_pad = 10
-
-    ax = plt.subplot(2, 4, 1)
-    plt.imshow(vis_data_dict["target"], cmap='gray')
-    plt.axis('off')
+def _build_result_fig(panel_data, vis_data_dict, title_font_size, show):
+    """Build the result figure, returns the figure and its data artists {panel name: artist}"""
+    # render with the Agg canvas directly, pyplot (and its global figure manager) is only used to show
+    if show:
+        fig = plt.figure(figsize=RESULT_FIG_SIZE)
+    else:
+        fig = Figure(figsize=RESULT_FIG_SIZE)
+        FigureCanvasAgg(fig)
+    title_pad = RESULT_FIG_TITLE_PAD
+    axes = fig.subplots(2, 4)
+    artists = dict()
+
+    ax = axes[0, 0]
+    artists["target"] = ax.imshow(panel_data["target"], cmap='gray')
+    ax.axis('off')
     ax.set_title('Target', fontsize=title_font_size, pad=title_pad)
 
-    ax = plt.subplot(2, 4, 2)
-    plt.imshow(vis_data_dict["target_original"], cmap='gray')
-    plt.axis('off')
+    ax = axes[0, 1]
+    artists["target_original"] = ax.imshow(panel_data["target_original"], cmap='gray')
+    ax.axis('off')
     ax.set_title('Target original', fontsize=title_font_size, pad=title_pad)
 
-    # calculate the error before and after reg
-    error_before = vis_data_dict["target"] - vis_data_dict["target_original"]
-    error_after = vis_data_dict["target"] - vis_data_dict["target_pred"]
-
     # error before
-    ax = plt.subplot(2, 4, 3)
-    plt.imshow(error_before, vmin=-2, vmax=2, cmap='seismic')  # assuming images were normalised to [0, 1]
-    plt.axis('off')
+    ax = axes[0, 2]
+    artists["error_before"] = ax.imshow(panel_data["error_before"], vmin=-2, vmax=2, cmap='seismic')  # assuming images were normalised to [0, 1]
+    ax.axis('off')
     ax.set_title('Error before', fontsize=title_font_size, pad=title_pad)
 
     # error after
-    ax = plt.subplot(2, 4, 4)
-    plt.imshow(error_after, vmin=-2, vmax=2, cmap='seismic')  # assuming images were normalised to [0, 1]
-    plt.axis('off')
+    ax = axes[0, 3]
+    artists["error_after"] = ax.imshow(panel_data["error_after"], vmin=-2, vmax=2, cmap='seismic')  # assuming images were normalised to [0, 1]
+    ax.axis('off')
     ax.set_title('Error after', fontsize=title_font_size, pad=title_pad)
 
     # predicted target image
-    ax = plt.subplot(2, 4, 5)
-    plt.imshow(vis_data_dict["target_pred"], cmap='gray')
-    plt.axis('off')
+    ax = axes[1, 0]
+    artists["target_pred"] = ax.imshow(panel_data["target_pred"], cmap='gray')
+    ax.axis('off')
     ax.set_title('Target predict', fontsize=title_font_size, pad=title_pad)
 
     # warped source image
-    ax = plt.subplot(2, 4, 6)
-    plt.imshow(vis_data_dict["warped_source"], cmap='gray')
-    plt.axis('off')
+    ax = axes[1, 1]
+    artists["warped_source"] = ax.imshow(panel_data["warped_source"], cmap='gray')
+    ax.axis('off')
     ax.set_title('Warped source', fontsize=title_font_size, pad=title_pad)
 
     # warped grid: ground truth
-    ax = plt.subplot(2, 4, 7)
+    ax = axes[1, 2]
     bg_img = np.zeros_like(vis_data_dict["target"])
-    plot_warped_grid(ax, vis_data_dict["disp_gt"], bg_img, interval=3, title="$\phi_{GT}$", fontsize=title_font_size)
+    artists["disp_gt"] = plot_warped_grid(ax, vis_data_dict["disp_gt"], bg_img, interval=3,
+                                          title="$\phi_{GT}$", fontsize=title_font_size)
 
     # warped grid: prediction
-    ax = plt.subplot(2, 4, 8)
-    plot_warped_grid(ax, vis_data_dict["disp_pred"], bg_img, interval=3, title="$\phi_{pred}$", fontsize=title_font_size)
+    ax = axes[1, 3]
+    artists["disp_pred"] = plot_warped_grid(ax, vis_data_dict["disp_pred"], bg_img, interval=3,
+                                            title="$\phi_{pred}$", fontsize=title_font_size)
 
     # adjust subplot placements and spacing
-    plt.subplots_adjust(left=0.0001, right=0.99, top=0.9, bottom=0.1, wspace=0.001, hspace=0.1)
+    fig.subplots_adjust(**RESULT_FIG_ADJUST)
+    return fig, artists
+
+
+def _update_result_fig(artists, panel_data, vis_data_dict):
+    """Update the data of the artists in a cached result figure"""
+    for name, x in panel_data.items():
+        artists[name].set_data(x)
+        if not name.startswith('error'):
+            # grayscale images are colour-scaled to their own range, as a new imshow would
+            artists[name].autoscale()
+
+    sizes = vis_data_dict["target"].shape
+    for name in ["disp_gt", "disp_pred"]:
+        artists[name].set_segments(warped_grid_lines(vis_data_dict[name], sizes, interval=3))
+
+
+# result figures for repeated rendering without showing, reused across calls of plot_result_fig(reuse=True)
+# {(H, W, title_font_size): (fig, artists)}
+_RESULT_FIG_CACHE = dict()
+
+
+def plot_result_fig(vis_data_dict, save_path=None, title_font_size=20, dpi=100, show=False, close=False,
+                    reuse=False):
+    """Plot visual results in a single figure/subplots.
+    Images should be shaped (*sizes)
+    Disp should be shaped (ndim, *sizes)
+
+    vis_data_dict.keys() = ['target', 'source', 'target_original',
+                            'target_pred', 'warped_source',
+                            'disp_gt', 'disp_pred']
+
+    If `reuse` (and not showing), the figure is built once for each image size and font size,
+    later calls only update its data and return the same figure, which is overwritten by the next call.
+    Closing a reused figure (`close=True`) releases it.
+    """
+    # calculate the error before and after reg
+    panel_data = {"target": vis_data_dict["target"],
+                  "target_original": vis_data_dict["target_original"],
+                  "error_before": vis_data_dict["target"] - vis_data_dict["target_original"],
+                  "error_after": vis_data_dict["target"] - vis_data_dict["target_pred"],
+                  "target_pred": vis_data_dict["target_pred"],
+                  "warped_source": vis_data_dict["warped_source"]}
+
+    cache_key = (*vis_data_dict["target"].shape, title_font_size)
+    if show or not reuse:
+        fig, _ = _build_result_fig(panel_data, vis_data_dict, title_font_size, show)
+    elif cache_key in _RESULT_FIG_CACHE:
+        fig, artists = _RESULT_FIG_CACHE[cache_key]
+        _update_result_fig(artists, panel_data, vis_data_dict)
+    else:
+        fig, artists = _build_result_fig(panel_data, vis_data_dict, title_font_size, show)
+        _RESULT_FIG_CACHE[cache_key] = (fig, artists)
 
     # saving
     if save_path is not None:
@@ -105,11 +171,14 @@ def plot_result_fig(vis_data_dict, save_path=None, title_font_size=20, dpi=100,
         plt.show()
 
     if close:
-        plt.close()
+        # figures not shown are not managed by pyplot, a reused figure is released from the cache
+        if reuse and not show:
+            _RESULT_FIG_CACHE.pop(cache_key, None)
+        plt.close(fig)
     return fig
 
 
-def visualise_result(data_dict, axis=0, save_result_dir=None, epoch=None, dpi=50):
+def visualise_result(data_dict, axis=0, save_result_dir=None, epoch=None, dpi=50, reuse=False):
     """
     Save one validation visualisation figure for each epoch.
     - 2D: 1 random slice from N-slice stack (not a sequence)
@@ -121,6 +190,7 @@ def visualise_result(data_dict, axis=0, save_result_dir=None, epoch=None, dpi=50
         epoch: (int) Epoch number (for naming when saving)
         axis: (int) For 3D only, choose the 2D plane orthogonal to this axis in 3D volume
         dpi: (int) Image resolution of saved figure
+        reuse: (bool) Reuse the figure of the previous call (see `plot_result_fig`)
     """
     # check cast to Numpy array
     for n, d in data_dict.items():
@@ -161,5 +231,5 @@ def visualise_result(data_dict, axis=0, save_result_dir=None, epoch=None, dpi=50
     else:
         fig_save_path = None
 
-    fig = plot_result_fig(vis_data_dict, save_path=fig_save_path, dpi=dpi)
+    fig = plot_result_fig(vis_data_dict, save_path=fig_save_path, dpi=dpi, reuse=reuse)
     return fig